@@ -1,90 +1,255 @@
-from pypdf import PdfReader
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
 from PIL import Image
 import pytesseract
 from pdf2image import convert_from_path
 import numpy as np
+import cv2
 import logging
+import os
+import tempfile
+import hashlib
+import multiprocessing
+from contextlib import nullcontext
+from functools import wraps
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def is_scanned_pdf(pdf_path):
-    """Check if PDF is scanned (image-based) using multiple detection methods"""
+CACHE_DIR = "./cache"
+# Bump whenever extraction output changes (engine, DPI, preprocessing) so stale text is never served
+CACHE_VERSION = "pdfium-otsu-200dpi-1"
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Pools start children from a clean interpreter: forking the API process would copy its
+# live ONNX Runtime session, Chroma client and writer thread into every worker
+MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+)
+
+# Machine-wide CPU slots, shared by the extraction pool and every per-document OCR pool.
+# Pools may be wide (a lone scanned PDF gets a process per core), but only this many
+# Tesseract/PDFium calls run at once, however documents and pages are interleaved.
+_CPU_SLOTS = None
+
+def init_worker(cpu_slots):
+    """Pool initializer: install the shared CPU slot semaphore in a worker process"""
+    global _CPU_SLOTS
+    _CPU_SLOTS = cpu_slots
+
+def _cpu_slot():
+    """Hold one CPU slot for the duration of a CPU-bound call (no-op outside the backend's pools)"""
+    return _CPU_SLOTS if _CPU_SLOTS is not None else nullcontext()
+
+# Tesseract's own OpenMP threads would multiply on top of the page-level pool
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+def _content_hash(file_path):
+    """BLAKE2b digest of a file's bytes and the pipeline version, used as the extraction cache key"""
+    digest = hashlib.blake2b(CACHE_VERSION.encode(), digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_get(key):
+    path = os.path.join(CACHE_DIR, f"{key}.txt")
+    try:
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        os.utime(path)  # mtime doubles as last-use time for eviction
+        return text
+    except OSError:
+        return None
+
+def _cache_put(key, text):
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Write then rename so concurrent readers never see a partial entry
+        tmp_path = os.path.join(CACHE_DIR, f"{key}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, os.path.join(CACHE_DIR, f"{key}.txt"))
+    except OSError as e:
+        logger.warning(f"Failed to write cache entry {key}: {str(e)}")
+
+def _evict_cache(max_bytes=CACHE_MAX_BYTES):
+    """Delete least recently used cache entries until the cache fits in max_bytes"""
+    entries = []
+    try:
+        for entry in os.scandir(CACHE_DIR):
+            if entry.name.endswith('.txt'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+    except OSError:
+        return
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            continue
+
+def cached_by_content(func):
+    """Reuse extracted text for files whose bytes have been processed before"""
+    @wraps(func)
+    def wrapper(file_path):
+        try:
+            key = _content_hash(file_path)
+        except OSError as e:
+            logger.warning(f"Could not hash {file_path}, skipping cache: {str(e)}")
+            return func(file_path)
+        
+        cached = _cache_get(key)
+        if cached is not None:
+            logger.info(f"Cache hit for {file_path} ({key})")
+            return cached
+        
+        text = func(file_path)
+        if text and text.strip():  # Don't cache failed extractions
+            _cache_put(key, text)
+            _evict_cache()
+        return text
+    return wrapper
+
+def _gray_std(arr):
+    """Standard deviation of a uint8 image in a single pass, via its 256-bin histogram"""
+    hist = np.bincount(arr.ravel(), minlength=256)
+    n = hist.sum()
+    if n == 0:
+        return 0.0
+    levels = np.arange(256, dtype=np.float64)
+    mean = hist @ levels / n
+    return float(np.sqrt(hist @ (levels - mean) ** 2 / n))
+
+def _probe_pdf(pdf_path):
+    """Detect scanned vs native PDF; also returns the opened PdfDocument (or None) for reuse"""
+    pdf = None
     try:
-        # Method 1: Text extraction check
+        # Method 1: Text extraction check (PDFium loads pages on demand, so only page 0 is read)
         try:
-            with open(pdf_path, 'rb') as f:
-                reader = PdfReader(f)
-                first_page_text = reader.pages[0].extract_text() or ""
-                if len(first_page_text.strip()) > 50:
-                    logger.info(f"PDF {pdf_path} detected as native (text extracted)")
-                    return False
+            pdf = pdfium.PdfDocument(pdf_path)
+            first_page = pdf[0]
+            first_page_text = first_page.get_textpage().get_text_range().strip()
+            if len(first_page_text) > 50:
+                logger.info(f"PDF {pdf_path} detected as native (text extracted)")
+                return False, pdf
+            
+            # No text and no text objects means there is no text layer at all - skip the render probe
+            text_objects = first_page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_TEXT,))
+            if not first_page_text and next(text_objects, None) is None:
+                logger.info(f"PDF {pdf_path} detected as scanned (no text layer)")
+                return True, pdf
         except Exception as e:
             logger.warning(f"Text extraction check failed for {pdf_path}: {str(e)}")
         
-        # Method 2: Image variance check
+        # Method 2: Image variance check - only reached when text extraction failed or was inconclusive
         try:
             images = convert_from_path(pdf_path, first_page=1, last_page=1, dpi=100)
             if not images:
                 logger.warning(f"No images extracted from {pdf_path}")
-                return True
+                return True, pdf
                 
-            img_array = np.array(images[0].convert('L'))  # Convert to grayscale
-            if np.std(img_array) > 25:  # Higher variance indicates text
+            # Grayscale view strided 8x8 - 64x fewer pixels, same variance for the threshold
+            sample = np.asarray(images[0].convert('L'))[::8, ::8]
+            if _gray_std(sample) > 25:  # Higher variance indicates text
                 logger.info(f"PDF {pdf_path} detected as native (image variance)")
-                return False
+                return False, pdf
         except Exception as e:
             logger.warning(f"Image analysis check failed for {pdf_path}: {str(e)}")
         
         logger.info(f"PDF {pdf_path} detected as scanned")
-        return True  # Default to scanned if checks are inconclusive
+        return True, pdf  # Default to scanned if checks are inconclusive
         
     except Exception as e:
         logger.error(f"PDF type detection failed for {pdf_path}: {str(e)}")
-        return True  # Fallback to OCR processing
+        return True, pdf  # Fallback to OCR processing
+
+def is_scanned_pdf(pdf_path):
+    """Check if PDF is scanned (image-based) using multiple detection methods"""
+    return _probe_pdf(pdf_path)[0]
 
-def pdf_to_images(pdf_path):
-    """Convert PDF to high-res images for OCR with error handling"""
+def pdf_to_images(pdf_path, output_folder, paths_only=False):
+    """Convert PDF to high-res images for OCR, streaming pages to disk (the caller owns output_folder)"""
     try:
         images = convert_from_path(
             pdf_path,
-            dpi=300,
+            dpi=200,
             grayscale=True,
-            thread_count=4,
+            thread_count=max(1, (os.cpu_count() or 2) - 1),
             fmt='jpeg',
+            output_folder=output_folder,
+            paths_only=paths_only,
             poppler_path=None  # Add path if needed: e.g., r'/usr/local/bin'
         )
-        logger.info(f"Converted {pdf_path} to {len(images)} images")
+        logger.info(f"Converted {pdf_path} to {len(images)} images in {output_folder}")
         return images
     except Exception as e:
         logger.error(f"PDF to image conversion failed for {pdf_path}: {str(e)}")
         raise
 
+def _ocr_page(img_path, psm_config):
+    """OCR a single rendered page and delete it; runs inside a worker process"""
+    try:
+        # Identical page renders (re-uploads, shared cover pages) reuse cached OCR text
+        key = _content_hash(img_path)
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+        with _cpu_slot():
+            with Image.open(img_path) as img:
+                # Otsu binarization gives Tesseract clean glyph edges and less to segment
+                arr = np.asarray(img.convert('L'))
+            _, bw = cv2.threshold(arr, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+            ocr_text = pytesseract.image_to_string(Image.fromarray(bw), config=psm_config, timeout=15)
+        if ocr_text and ocr_text.strip():
+            _cache_put(key, ocr_text)
+        return ocr_text
+    except RuntimeError as e:
+        logger.warning(f"OCR timed out or failed for {img_path}: {str(e)}")
+        return None
+    finally:
+        try:
+            os.remove(img_path)
+        except OSError:
+            pass
+
 def process_scanned_pdf(pdf_path):
     """Robust OCR processing pipeline for scanned PDFs"""
     try:
-        images = pdf_to_images(pdf_path)
-        if not images:
-            logger.warning(f"No images extracted from {pdf_path}")
-            return ""
+        with tempfile.TemporaryDirectory(prefix="documind_") as tmp_dir:
+            # Pages are rendered to disk and passed to workers by path, so neither
+            # the parent nor the pool ever holds every decoded page in memory
+            page_paths = pdf_to_images(pdf_path, output_folder=tmp_dir, paths_only=True)
+            if not page_paths:
+                logger.warning(f"No images extracted from {pdf_path}")
+                return ""
+            
+            # Not holding a slot while waiting here, so pages can take every free one
+            max_workers = min(len(page_paths), os.cpu_count() or 1)
+            with ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=MP_CONTEXT,
+                initializer=init_worker,
+                initargs=(_CPU_SLOTS,)
+            ) as executor:
+                ocr_results = list(executor.map(_ocr_page, page_paths, repeat('--psm 6 -l eng+equ')))
             
         text = []
-        for page_num, img in enumerate(images, 1):
-            try:
-                ocr_text = pytesseract.image_to_string(
-                    img,
-                    config='--psm 6 -l eng+equ',
-                    timeout=15
-                )
-                if ocr_text and ocr_text.strip():
-                    text.append(f"[Page {page_num}]\n{ocr_text.strip()}")
-                    logger.info(f"OCR extracted text from page {page_num} of {pdf_path}")
-                else:
-                    logger.warning(f"No text extracted from page {page_num} of {pdf_path}")
-            except RuntimeError as e:
-                logger.warning(f"OCR failed for page {page_num} of {pdf_path}: {str(e)}")
-                continue
+        for page_num, ocr_text in enumerate(ocr_results, 1):
+            if ocr_text is None:
+                logger.warning(f"OCR failed for page {page_num} of {pdf_path}")
+            elif ocr_text.strip():
+                text.append(f"[Page {page_num}]\n{ocr_text.strip()}")
+                logger.info(f"OCR extracted text from page {page_num} of {pdf_path}")
+            else:
+                logger.warning(f"No text extracted from page {page_num} of {pdf_path}")
                 
         extracted_text = '\n\n'.join(filter(None, text))
         logger.info(f"Extracted {len(extracted_text)} characters from scanned PDF {pdf_path}")
@@ -93,38 +258,44 @@ def process_scanned_pdf(pdf_path):
         logger.error(f"Scanned PDF processing failed for {pdf_path}: {str(e)}")
         return ""
 
-def extract_text_from_pdf(pdf_path):
-    """Improved text extraction from native PDFs with page markers"""
+def extract_text_from_pdf(pdf_path, pdf=None):
+    """Improved text extraction from native PDFs via PDFium with page markers (reuses `pdf` if given)"""
     text = []
+    owns_pdf = pdf is None
     try:
-        with open(pdf_path, 'rb') as file:
-            reader = PdfReader(file)
-            for page_num, page in enumerate(reader.pages, 1):
-                try:
-                    page_text = page.extract_text()
-                    if page_text and page_text.strip():
-                        text.append(f"[Page {page_num}]\n{page_text.strip()}")
-                        logger.info(f"Extracted text from page {page_num} of {pdf_path}")
-                    else:
-                        logger.warning(f"No text extracted from page {page_num} of {pdf_path}")
-                except Exception as e:
-                    logger.warning(f"Page {page_num} extraction failed for {pdf_path}: {str(e)}")
-                    continue
-                    
+        if owns_pdf:
+            pdf = pdfium.PdfDocument(pdf_path)
+        for page_num in range(1, len(pdf) + 1):
+            try:
+                page_text = pdf[page_num - 1].get_textpage().get_text_range()
+                if page_text and page_text.strip():
+                    text.append(f"[Page {page_num}]\n{page_text.strip()}")
+                    logger.info(f"Extracted text from page {page_num} of {pdf_path}")
+                else:
+                    logger.warning(f"No text extracted from page {page_num} of {pdf_path}")
+            except Exception as e:
+                logger.warning(f"Page {page_num} extraction failed for {pdf_path}: {str(e)}")
+                continue
+                
         extracted_text = '\n\n'.join(filter(None, text))
         logger.info(f"Extracted {len(extracted_text)} characters from native PDF {pdf_path}")
         return extracted_text
     except Exception as e:
         logger.error(f"PDF extraction failed for {pdf_path}: {str(e)}")
         return ""
+    finally:
+        if owns_pdf and pdf is not None:
+            pdf.close()
 
+@cached_by_content
 def process_document(file_path):
     """Smart document processor with automatic type detection"""
     try:
         # Check file extension first
         if file_path.lower().endswith(('.png', '.jpg', '.jpeg')):
             try:
-                text = pytesseract.image_to_string(Image.open(file_path))
+                with _cpu_slot():
+                    text = pytesseract.image_to_string(Image.open(file_path))
                 logger.info(f"Extracted {len(text)} characters from image {file_path}")
                 # Print first 500 characters
                 logger.info(f"First 500 characters of {file_path}:\n{text[:500] + '...' if len(text) > 500 else text}")
@@ -134,12 +305,18 @@ def process_document(file_path):
                 return ""
         
         # Process PDF files
-        if is_scanned_pdf(file_path):
-            logger.info(f"Processing as scanned PDF: {file_path}")
-            text = process_scanned_pdf(file_path)
-        else:
-            logger.info(f"Processing as native PDF: {file_path}")
-            text = extract_text_from_pdf(file_path)
+        scanned, pdf = _probe_pdf(file_path)
+        try:
+            if scanned:
+                logger.info(f"Processing as scanned PDF: {file_path}")
+                text = process_scanned_pdf(file_path)
+            else:
+                logger.info(f"Processing as native PDF: {file_path}")
+                with _cpu_slot():
+                    text = extract_text_from_pdf(file_path, pdf=pdf)
+        finally:
+            if pdf is not None:
+                pdf.close()
             
         # Print first 500 characters
         if text and text.strip():
@@ -0,0 +1,28 @@
+import time
+from typing import Dict, Optional
+
+JOB_TTL_SECONDS = 3600  # Finished jobs stay queryable for an hour
+
+class UploadJobs:
+    """In-memory upload job state; the backend runs as a single process, see main.py"""
+
+    def __init__(self, ttl: float = JOB_TTL_SECONDS):
+        self.ttl = ttl
+        self._jobs: Dict[str, dict] = {}
+        self._finished_at: Dict[str, float] = {}
+
+    def create(self, document_id: str, **fields):
+        """Record a new job and evict finished jobs older than the TTL"""
+        cutoff = time.time() - self.ttl
+        for expired in [job_id for job_id, finished in self._finished_at.items() if finished < cutoff]:
+            del self._jobs[expired], self._finished_at[expired]
+        self._jobs[document_id] = dict(fields)
+
+    def update(self, document_id: str, **fields):
+        """Merge fields into an existing job's state"""
+        self._jobs[document_id].update(fields)
+        if fields.get("status") in ("completed", "failed"):
+            self._finished_at[document_id] = time.time()
+
+    def get(self, document_id: str) -> Optional[dict]:
+        return self._jobs.get(document_id)
@@ -9,11 +9,17 @@ import pytesseract
 from PIL import Image
 import io
 import time  # Added missing import
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
 from .vector_db import VectorDB
-from .document_processor import extract_text_from_pdf
+from .document_processor import process_document, init_worker, MP_CONTEXT
+from .jobs import UploadJobs
 from datetime import datetime
 import re
-from typing import List
+from typing import List, Tuple
+from collections import defaultdict
+import ahocorasick
+import aiofiles
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -31,78 +37,260 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _acquire_single_process_lock(path: str = "data/.backend.lock"):
+    """Refuse to start a second backend process on this working directory"""
+    # Each process opens its own PersistentClient and in-memory HNSW index on ./chroma_db:
+    # a second worker would neither see the first one's chunks nor persist safely alongside it
+    try:
+        import fcntl
+    except ImportError:  # Windows: no advisory locks, single worker is on the operator
+        return None
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lock_file = open(path, "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise RuntimeError("Another DocuMind backend process is already using ./chroma_db; run a single worker")
+    return lock_file  # Held (and the lock with it) for the life of the process
+
+_process_lock = _acquire_single_process_lock()
+
 # Initialize VectorDB
 vector_db = VectorDB()
 
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Background ingestion state: document_id -> {"status": queued|processing|completed|failed, ...}
+upload_jobs = UploadJobs()
+_background_tasks = set()  # Strong refs so pending tasks aren't garbage collected
+
+@app.on_event("startup")
+async def start_executor():
+    # Extraction is CPU-bound (PDFium/Tesseract); keep it off the event loop in worker
+    # processes. One CPU slot per core is shared with every scanned PDF's own OCR pool, so
+    # documents and pages split the cores dynamically (see document_processor).
+    cpu_count = os.cpu_count() or 1
+    app.state.executor = ProcessPoolExecutor(
+        max_workers=cpu_count,
+        mp_context=MP_CONTEXT,
+        initializer=init_worker,
+        initargs=(MP_CONTEXT.BoundedSemaphore(cpu_count),)
+    )
+
+@app.on_event("shutdown")
+async def stop_executor():
+    app.state.executor.shutdown(wait=False)
+    # The Chroma writer is a daemon thread; drain it so shutdown can't cut off a collection.add
+    await asyncio.get_running_loop().run_in_executor(None, vector_db.flush)
+
+# Theme keywords, matched case-insensitively against retrieved chunks
+THEME_KEYWORDS = {
+    "Regulatory Non-Compliance": ["non-compliance", "violation", "regulation", "SEBI", "LODR"],
+    "Penalty Justification": ["penalty", "fine", "sanction", "statutory"],
+    "Legal Framework": ["act", "law", "clause", "section"]
+}
+
+def _build_theme_automaton():
+    """Compile every theme keyword into one Aho-Corasick automaton"""
+    automaton = ahocorasick.Automaton()
+    for theme, keywords in THEME_KEYWORDS.items():
+        for keyword in keywords:
+            keyword_lower = keyword.lower()
+            if keyword_lower in automaton:
+                automaton.get(keyword_lower).add(theme)
+            else:
+                automaton.add_word(keyword_lower, {theme})
+    automaton.make_automaton()
+    return automaton
+
+theme_automaton = _build_theme_automaton()
+
+def _start_background(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _save_upload(file: UploadFile) -> Tuple[str, str]:
+    """Validate an upload and stream it to disk; returns (document_id, file_path)"""
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No filename provided")
+    
+    # Validate file type
+    allowed_extensions = {'.pdf', '.png', '.jpg', '.jpeg'}
+    file_ext = os.path.splitext(file.filename)[1].lower()
+    if file_ext not in allowed_extensions:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed: {', '.join(allowed_extensions)}")
+    
+    # Generate unique document ID
+    document_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
+    
+    # Stream to disk in 64KB chunks, enforcing the 10MB limit as we go
+    os.makedirs("data", exist_ok=True)
+    file_path = f"data/{document_id}"
+    try:
+        size = 0
+        async with aiofiles.open(file_path, "wb") as f:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=400, detail=f"{file.filename} is too large. Maximum size is 10MB")
+                await f.write(chunk)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return document_id, file_path
+
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     try:
-        if not file.filename:
-            raise HTTPException(status_code=400, detail="No filename provided")
+        document_id, file_path = await _save_upload(file)
         
-        # Validate file type
-        allowed_extensions = {'.pdf', '.png', '.jpg', '.jpeg'}
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        if file_ext not in allowed_extensions:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type. Allowed: {', '.join(allowed_extensions)}")
+        # Hand off to the background pipeline; the task now owns (and removes) the file
+        upload_jobs.create(document_id, status="queued", filename=file.filename)
+        _start_background(_process_upload(document_id, file.filename, file_path))
         
-        # Check file size (10MB limit)
-        content = await file.read()
-        if len(content) > 10 * 1024 * 1024:
-            raise HTTPException(status_code=400, detail="File too large. Maximum size is 10MB")
-        
-        # Generate unique document ID
-        document_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
+        logger.info(f"Queued {file.filename} for processing as {document_id}")
+        return JSONResponse(
+            content={
+                "filename": file.filename,
+                "document_id": document_id,
+                "status": "queued"
+            },
+            status_code=202
+        )
         
-        # Save file temporarily
-        os.makedirs("data", exist_ok=True)
-        file_path = f"data/{document_id}"
-        with open(file_path, "wb") as f:
-            f.write(content)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upload failed for {file.filename}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+
+@app.post("/upload_batch")
+async def upload_batch(files: List[UploadFile] = File(...)):
+    saved = []
+    try:
+        for file in files:
+            document_id, file_path = await _save_upload(file)
+            saved.append((document_id, file.filename, file_path))
+    except Exception as e:
+        # All-or-nothing: drop whatever was already saved from this request
+        for _, _, file_path in saved:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        if isinstance(e, HTTPException):
+            raise
+        logger.error(f"Batch upload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+    
+    for document_id, filename, _ in saved:
+        upload_jobs.create(document_id, status="queued", filename=filename)
+    _start_background(_process_upload_batch(saved))
+    
+    logger.info(f"Queued batch of {len(saved)} files for processing")
+    return JSONResponse(
+        content={
+            "documents": [
+                {"filename": filename, "document_id": document_id, "status": "queued"}
+                for document_id, filename, _ in saved
+            ]
+        },
+        status_code=202
+    )
+
+async def _process_upload(document_id: str, filename: str, file_path: str):
+    """Extract, chunk and store an uploaded file, recording progress in upload_jobs"""
+    loop = asyncio.get_running_loop()
+    try:
+        upload_jobs.update(document_id, status="processing")
         
         # Extract text
         start_time = time.time()
-        text = extract_text_from_pdf(file_path)
+        text = await loop.run_in_executor(app.state.executor, process_document, file_path)
         extract_time = time.time() - start_time
-        logger.info(f"Text extraction for {file.filename} took {extract_time:.2f}s")
+        logger.info(f"Text extraction for {filename} took {extract_time:.2f}s")
         
         if not text:
-            os.remove(file_path)
-            raise HTTPException(status_code=400, detail="No text extracted from file")
+            upload_jobs.update(document_id, status="failed", detail="No text extracted from file")
+            return
         
-        # Store in VectorDB
+        # Store in VectorDB (in a thread: the model and Chroma client live in this process)
         metadata = {
             "document_id": document_id,
-            "filename": file.filename,
+            "filename": filename,
             "upload_date": datetime.now().isoformat()
         }
         start_time = time.time()
-        chunk_count = vector_db.add_document(text, metadata)
+        chunk_count = await loop.run_in_executor(None, vector_db.add_document, text, metadata)
         store_time = time.time() - start_time
-        logger.info(f"Storing {file.filename} with {chunk_count} chunks took {store_time:.2f}s")
+        logger.info(f"Storing {filename} with {chunk_count} chunks took {store_time:.2f}s")
+        
+        upload_jobs.update(document_id, status="completed", chunks_stored=chunk_count)
+        logger.info(f"Successfully processed {filename}: {chunk_count} chunks")
         
-        # Clean up
+    except Exception as e:
+        logger.error(f"Processing failed for {filename}: {str(e)}")
+        upload_jobs.update(document_id, status="failed", detail=f"Processing failed: {str(e)}")
+    finally:
         if os.path.exists(file_path):
             os.remove(file_path)
+
+async def _process_upload_batch(saved: List[Tuple[str, str, str]]):
+    """Extract all files of a batch in parallel, then store them with one bulk insert"""
+    loop = asyncio.get_running_loop()
+    try:
+        for document_id, _, _ in saved:
+            upload_jobs.update(document_id, status="processing")
         
-        logger.info(f"Successfully uploaded {file.filename}: {chunk_count} chunks")
-        return JSONResponse(
-            content={
-                "filename": file.filename,
-                "document_id": document_id,
-                "chunks_stored": chunk_count
-            },
-            status_code=201
+        start_time = time.time()
+        texts = await asyncio.gather(
+            *(loop.run_in_executor(app.state.executor, process_document, file_path) for _, _, file_path in saved),
+            return_exceptions=True
         )
+        extract_time = time.time() - start_time
+        logger.info(f"Text extraction for batch of {len(saved)} files took {extract_time:.2f}s")
+        
+        docs = []
+        stored_ids = []
+        for (document_id, filename, _), text in zip(saved, texts):
+            if isinstance(text, Exception):
+                upload_jobs.update(document_id, status="failed", detail=f"Processing failed: {str(text)}")
+            elif not text:
+                upload_jobs.update(document_id, status="failed", detail="No text extracted from file")
+            else:
+                docs.append((text, {
+                    "document_id": document_id,
+                    "filename": filename,
+                    "upload_date": datetime.now().isoformat()
+                }))
+                stored_ids.append(document_id)
+        
+        if docs:
+            start_time = time.time()
+            chunk_counts = await loop.run_in_executor(None, vector_db.add_documents, docs)
+            store_time = time.time() - start_time
+            logger.info(f"Storing batch of {len(docs)} files with {sum(chunk_counts)} chunks took {store_time:.2f}s")
+            for document_id, chunk_count in zip(stored_ids, chunk_counts):
+                upload_jobs.update(document_id, status="completed", chunks_stored=chunk_count)
         
-    except HTTPException:
-        raise
     except Exception as e:
-        logger.error(f"Upload failed for {file.filename}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
+        logger.error(f"Batch processing failed: {str(e)}")
+        for document_id, _, _ in saved:
+            if upload_jobs.get(document_id)["status"] not in ("completed", "failed"):
+                upload_jobs.update(document_id, status="failed", detail=f"Processing failed: {str(e)}")
     finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        for _, _, file_path in saved:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+@app.get("/status/{document_id}")
+async def upload_status(document_id: str):
+    job = upload_jobs.get(document_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown document_id: {document_id}")
+    return {"document_id": document_id, **job}
 
 @app.get("/query")
 async def query(q: str, n_results: int = 3):
@@ -118,17 +306,21 @@ async def query(q: str, n_results: int = 3):
         # Theme identification
         themes = []
         if results["documents"]:
-            theme_keywords = {
-                "Regulatory Non-Compliance": ["non-compliance", "violation", "regulation", "SEBI", "LODR"],
-                "Penalty Justification": ["penalty", "fine", "sanction", "statutory"],
-                "Legal Framework": ["act", "law", "clause", "section"]
-            }
-            for theme, keywords in theme_keywords.items():
-                citations = []
-                for i, doc in enumerate(results["documents"]):
-                    if any(keyword.lower() in doc.lower() for keyword in keywords):
-                        citation = f"{results['metadatas'][i]['filename']} (page {', '.join(results['pages'][i])})"
-                        citations.append(citation)
+            # Scan each document once and group its citation under every theme it mentions
+            theme_hits = defaultdict(list)
+            for doc, meta, pages in zip(results["documents"], results["metadatas"], results["pages"]):
+                matched = set()
+                for _, themes_for_keyword in theme_automaton.iter(doc.lower()):
+                    matched.update(themes_for_keyword)
+                    if len(matched) == len(THEME_KEYWORDS):
+                        break  # Every theme already found, rest of the scan can't add anything
+                if matched:
+                    citation = f"{meta['filename']} (page {', '.join(pages)})"
+                    for theme in matched:
+                        theme_hits[theme].append(citation)
+            
+            for theme in THEME_KEYWORDS:  # Keep the declared theme order in the response
+                citations = theme_hits.get(theme)
                 if citations:
                     themes.append({
                         "name": theme,
@@ -1,19 +1,162 @@
 import logging
+import os
 import re
+import shutil
+import string
+import tempfile
 import time
+import copy
+import queue
+import threading
+from bisect import bisect_right
+from concurrent.futures import Future
 from chromadb import PersistentClient
 from chromadb.config import Settings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
+from chromadb.db.base import UniqueConstraintError
+import onnxruntime as ort
+from optimum.exporters.onnx import main_export
+from optimum.onnxruntime import ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+from transformers import AutoTokenizer
 from dotenv import load_dotenv
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import numpy as np
-import hashlib
-from functools import lru_cache
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+EMBEDDING_MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+ONNX_MODEL_DIR = "./onnx-minilm"
+ONNX_FP16_MODEL_DIR = "./onnx-minilm-fp16"
+EMBEDDING_BATCH_SIZE = 64
+MAX_SEQ_LENGTH = 256
+CHUNK_TOKENS = 254  # max_seq_length (256) minus [CLS]/[SEP], so chunks are never truncated
+CHUNK_OVERLAP_TOKENS = 32
+SENTENCE_DELIMITERS = ".?!"
+# Insert slice size: small enough that embedding slice k+1 overlaps the writer thread's
+# collection.add of slice k, far below Chroma's per-call limit (~5461 on SQLite)
+ADD_BATCH_SIZE = 256
+
+# HNSW tuned for small corpora (<10k chunks): a sparser graph builds faster, and a
+# high sync threshold batches index flushes to disk instead of syncing per add
+COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 8,
+    "hnsw:construction_ef": 64,
+    "hnsw:search_ef": 32,
+    "hnsw:sync_threshold": 10000
+}
+
+# Any run of whitespace and/or disallowed characters collapses to a single space.
+# Square brackets are kept so "[Page N]" markers survive into the chunks.
+_CLEAN_RE = re.compile(r'(?:[^\w\s\.\,\!\?\-\:\;\(\)\[\]]|\s)+')
+_PAGE_RE = re.compile(r'\[Page\s+(\d+)\]')
+
+# ASCII fast path for the same allow-list: str.translate maps every disallowed or
+# whitespace character to a space in C, leaving only the space runs to collapse
+_ASCII_ALLOWED = set(string.ascii_letters + string.digits + "_.,!?-:;()[]")
+_ASCII_CLEAN_TABLE = {i: ' ' for i in range(128) if chr(i) not in _ASCII_ALLOWED}
+_SPACES_RE = re.compile(r' {2,}')
+
+# Process-wide embedding model, shared by every VectorDB instance
+_MODEL_LOCK = threading.Lock()
+_MODEL: Optional[Tuple[ort.InferenceSession, object]] = None
+
+def _publish_export(output_dir: str, artifact: str, build) -> str:
+    """Run build(dir) in a sibling temp dir and rename it to output_dir, so no worker ever sees a partial export"""
+    artifact_path = os.path.join(output_dir, artifact)
+    if os.path.exists(artifact_path):
+        return artifact_path
+    
+    parent = os.path.dirname(os.path.abspath(output_dir))
+    tmp_dir = tempfile.mkdtemp(prefix=f".{os.path.basename(output_dir)}-", dir=parent)
+    try:
+        build(tmp_dir)
+        try:
+            os.replace(tmp_dir, output_dir)
+        except OSError:
+            if not os.path.exists(artifact_path):
+                # Partial directory left by an interrupted export from an older version
+                shutil.rmtree(output_dir, ignore_errors=True)
+                os.replace(tmp_dir, output_dir)
+            # Otherwise another worker published first; its export is identical
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return artifact_path
+
+def _export_onnx(output_dir: str = ONNX_MODEL_DIR) -> str:
+    """Export MiniLM to ONNX and INT8-quantize it (once); returns the quantized model path"""
+    def build(build_dir):
+        logger.info(f"Exporting {EMBEDDING_MODEL_NAME} to ONNX in {output_dir}")
+        # Plain transformers export: first output is last_hidden_state, pooled by us below
+        main_export(EMBEDDING_MODEL_NAME, output=build_dir, task="feature-extraction", library_name="transformers")
+        # Dynamic INT8 needs no calibration data; VNNI kernels are used where the CPU has them
+        quantizer = ORTQuantizer.from_pretrained(build_dir)
+        quantizer.quantize(
+            save_dir=build_dir,
+            quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+        )
+    
+    quantized_path = _publish_export(output_dir, "model_quantized.onnx", build)
+    logger.info(f"Using quantized embedding model at {quantized_path}")
+    return quantized_path
+
+def _export_onnx_fp16(output_dir: str = ONNX_FP16_MODEL_DIR) -> str:
+    """Export MiniLM to a half-precision ONNX graph for GPU inference (once); returns the model path"""
+    def build(build_dir):
+        logger.info(f"Exporting {EMBEDDING_MODEL_NAME} to FP16 ONNX in {output_dir}")
+        main_export(
+            EMBEDDING_MODEL_NAME,
+            output=build_dir,
+            task="feature-extraction",
+            library_name="transformers",
+            device="cuda",  # optimum only exports fp16 from a GPU
+            fp16=True
+        )
+    
+    return _publish_export(output_dir, "model.onnx", build)
+
+def _get_model() -> Tuple[ort.InferenceSession, object]:
+    """Return the process-wide ONNX session and tokenizer, loading them on first use"""
+    global _MODEL
+    if _MODEL is None:
+        # Double-checked so concurrent first callers (e.g. executor threads) load it only once
+        with _MODEL_LOCK:
+            if _MODEL is None:
+                _MODEL = _load_model()
+    return _MODEL
+
+def _load_model() -> Tuple[ort.InferenceSession, object]:
+    """Build the ONNX session and tokenizer"""
+    # Pin the intra-op pool explicitly rather than trusting the runtime default
+    threads = int(os.getenv("EMBEDDING_THREADS", "0")) or (os.cpu_count() or 1)
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL  # MiniLM is a linear graph
+    sess_options.intra_op_num_threads = threads
+    sess_options.inter_op_num_threads = 1
+    
+    # FP16 on GPU (tensor cores); INT8 on CPU, where half precision would be a step back.
+    # The CUDA provider only exists with onnxruntime-gpu installed (see requirements.txt).
+    session = None
+    if "CUDAExecutionProvider" in ort.get_available_providers():
+        try:
+            session = ort.InferenceSession(
+                _export_onnx_fp16(),
+                sess_options=sess_options,
+                providers=["CUDAExecutionProvider", "CPUExecutionProvider"]
+            )
+            model_dir, variant = ONNX_FP16_MODEL_DIR, "ONNX FP16, CUDA"
+        except Exception as e:
+            logger.warning(f"FP16 GPU embedding model unavailable, falling back to INT8 CPU: {str(e)}")
+    if session is None:
+        session = ort.InferenceSession(_export_onnx(), sess_options=sess_options, providers=["CPUExecutionProvider"])
+        model_dir, variant = ONNX_MODEL_DIR, f"ONNX INT8, {threads} threads"
+    
+    tokenizer = AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+    logger.info(f"Loaded optimized embedding model: {EMBEDDING_MODEL_NAME} ({variant})")
+    return session, tokenizer
+
 class VectorDB:
     def __init__(self):
         try:
@@ -30,42 +173,64 @@ class VectorDB:
             logger.info("Optimized embedding function initialized")
             
             # Validate or recreate collection
+            expected_dim = self.embedding_fn.dimension
+            collection_metadata = {**COLLECTION_METADATA, "dimension": expected_dim}
             try:
-                self.collection = self.client.get_or_create_collection(
-                    name="documents",
-                    embedding_function=self.embedding_fn,
-                    metadata={"hnsw:space": "cosine"}
-                )
-                # Check embedding dimension
-                sample_embedding = self.embedding_fn(["test"])[0]
-                expected_dim = len(sample_embedding)
-                if self.collection.count() > 0:
-                    peek_data = self.collection.peek(1)
-                    stored_dim = len(peek_data["embeddings"][0]) if peek_data.get("embeddings") else expected_dim
-                    if stored_dim != expected_dim:
-                        logger.warning(f"Dimension mismatch: stored={stored_dim}, expected={expected_dim}. Resetting collection.")
-                        self.client.delete_collection("documents")
+                # Fetch without metadata first: get_or_create_collection(metadata=...) would
+                # overwrite the stored dimension with the expected one before we could compare
+                try:
+                    self.collection = self.client.get_collection(
+                        name="documents",
+                        embedding_function=self.embedding_fn
+                    )
+                except ValueError:
+                    try:
                         self.collection = self.client.create_collection(
                             name="documents",
                             embedding_function=self.embedding_fn,
-                            metadata={"hnsw:space": "cosine"}
+                            metadata=collection_metadata
                         )
+                    except UniqueConstraintError:
+                        # Created concurrently since the lookup: use it rather than falling
+                        # through to the delete-and-recreate path below
+                        self.collection = self.client.get_collection(
+                            name="documents",
+                            embedding_function=self.embedding_fn
+                        )
+                # Check embedding dimension: recorded in metadata at creation; legacy
+                # collections without it fall back to reading one stored vector
+                stored_dim = (self.collection.metadata or {}).get("dimension")
+                if stored_dim is None and self.collection.count() > 0:
+                    peek_data = self.collection.peek(1)
+                    stored_dim = len(peek_data["embeddings"][0]) if peek_data.get("embeddings") else expected_dim
+                if stored_dim is not None and stored_dim != expected_dim:
+                    logger.warning(f"Dimension mismatch: stored={stored_dim}, expected={expected_dim}. Resetting collection.")
+                    self.client.delete_collection("documents")
+                    self.collection = self.client.create_collection(
+                        name="documents",
+                        embedding_function=self.embedding_fn,
+                        metadata=collection_metadata
+                    )
             except Exception as e:
                 logger.error(f"Collection initialization failed: {str(e)}. Creating new collection.")
                 self.client.delete_collection("documents")
                 self.collection = self.client.create_collection(
                     name="documents",
                     embedding_function=self.embedding_fn,
-                    metadata={"hnsw:space": "cosine"}
+                    metadata=collection_metadata
                 )
             
-            self.text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=400,
-                chunk_overlap=50,
-                length_function=len,
-                separators=["\n\n", "\n", ". ", "! ", "? ", " ", ""],
-                keep_separator=True
-            )
+            # Chunk in the embedding model's own token space (fast Rust tokenizer). A private copy:
+            # every call rewrites the backend's truncation/padding state, and the embedding
+            # function's instance is used concurrently by /query with truncation on
+            self.tokenizer = copy.deepcopy(self.embedding_fn.tokenizer)
+            self._tokenizer_lock = threading.Lock()  # Concurrent uploads would hit "Already borrowed"
+            
+            # Single writer thread serialising Chroma WAL/HNSW inserts, so _add_chunks can embed
+            # the next slice while the previous one is written. Bounded to keep embedding from
+            # running far ahead of the writer.
+            self._write_queue = queue.Queue(maxsize=4)
+            threading.Thread(target=self._writer, name="chroma-writer", daemon=True).start()
             
             logger.info(f"VectorDB initialized with {self.collection.count()} existing documents")
             
@@ -76,74 +241,144 @@ class VectorDB:
     def _clean_and_validate_text(self, text: str) -> str:
         if not text:
             return ""
-        text = re.sub(r'\s+', ' ', text.strip())
-        text = re.sub(r'[^\w\s\.\,\!\?\-\:\;\(\)]', ' ', text)
-        text = re.sub(r'\s+', ' ', text)
-        return text
+        text = text.strip()
+        if text.isascii():
+            return _SPACES_RE.sub(' ', text.translate(_ASCII_CLEAN_TABLE))
+        return _CLEAN_RE.sub(' ', text)
+
+    def _split_text(self, text: str) -> Tuple[List[str], List[int]]:
+        """Split text into overlapping token windows via offsets; returns (chunks, chunk start offsets)"""
+        with self._tokenizer_lock:
+            encoding = self.tokenizer(
+                text,
+                add_special_tokens=False,
+                return_offsets_mapping=True,
+                verbose=False
+            )
+        offsets = encoding["offset_mapping"]
+        n_tokens = len(offsets)
+        chunks = []
+        starts = []
+        start = 0
+        while start < n_tokens:
+            end = min(start + CHUNK_TOKENS, n_tokens)
+            if end < n_tokens:
+                # Prefer ending on a sentence boundary in the back half of the window
+                for j in range(end - 1, start + CHUNK_TOKENS // 2, -1):
+                    if text[offsets[j][1] - 1] in SENTENCE_DELIMITERS:
+                        end = j + 1
+                        break
+            chunks.append(text[offsets[start][0]:offsets[end - 1][1]])
+            starts.append(offsets[start][0])
+            if end >= n_tokens:
+                break
+            start = max(end - CHUNK_OVERLAP_TOKENS, start + 1)
+        return chunks, starts
 
-    def _extract_page_from_chunk(self, chunk: str) -> str:
-        page_match = re.search(r'\[Page\s+(\d+)\]', chunk)
-        return page_match.group(1) if page_match else "1"
+    @staticmethod
+    def _page_at(marker_offsets: List[int], marker_pages: List[str], offset: int) -> str:
+        """Page of the last "[Page N]" marker at or before offset (text without markers is page 1)"""
+        i = bisect_right(marker_offsets, offset) - 1
+        return marker_pages[i] if i >= 0 else "1"
+
+    def _prepare_chunks(self, text: str, metadata: dict) -> Tuple[List[str], List[dict], List[str]]:
+        if not text or len(text.strip()) < 20:
+            logger.warning(f"Text too short for document {metadata.get('document_id', 'unknown')}")
+            return [], [], []
+        
+        cleaned_text = self._clean_and_validate_text(text)
+        if not cleaned_text:
+            logger.warning(f"No valid text after cleaning for {metadata.get('document_id')}")
+            return [], [], []
+        
+        chunks, starts = self._split_text(cleaned_text)
+        if not chunks:
+            logger.warning(f"No chunks created for document {metadata.get('document_id')}")
+            return [], [], []
+        
+        # A chunk belongs to the page it starts on, whether or not a marker falls inside it
+        markers = list(_PAGE_RE.finditer(cleaned_text))
+        marker_offsets = [m.start() for m in markers]
+        marker_pages = [m.group(1) for m in markers]
+        
+        valid_chunks = []
+        chunk_metadatas = []
+        chunk_ids = []
+        for index, (chunk, start) in enumerate(zip(chunks, starts)):
+            if len(chunk.strip()) < 20:
+                continue
+            
+            chunk_id = f"{metadata['document_id']}_chunk_{index}"
+            chunk_metadatas.append({
+                **metadata,
+                "chunk_id": chunk_id,
+                "page": self._page_at(marker_offsets, marker_pages, start),
+                "chunk_index": index,
+                "text_length": len(chunk)
+            })
+            chunk_ids.append(chunk_id)
+            valid_chunks.append(chunk)
+        
+        return valid_chunks, chunk_metadatas, chunk_ids
+
+    def _writer(self):
+        while True:
+            item, future = self._write_queue.get()
+            try:
+                start_time = time.time()
+                self.collection.add(**item)
+                future.set_result(time.time() - start_time)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._write_queue.task_done()
+
+    def flush(self):
+        """Block until every queued insert has been written (tests / shutdown)"""
+        self._write_queue.join()
+
+    def _add_chunks(self, chunks: List[str], metadatas: List[dict], ids: List[str]) -> List[bool]:
+        """Embed and insert chunks slice by slice, overlapping embedding with the writer; returns per-chunk success"""
+        added = [False] * len(chunks)
+        pending = []
+        for i in range(0, len(chunks), ADD_BATCH_SIZE):
+            batch_chunks = chunks[i:i + ADD_BATCH_SIZE]
+            try:
+                start_time = time.time()
+                # Embed explicitly so Chroma stores our vectors as-is instead of dispatching
+                # back into the embedding function itself
+                embeddings = self.embedding_fn(batch_chunks)
+                embed_time = time.time() - start_time
+                future = Future()
+                self._write_queue.put(({
+                    "embeddings": embeddings,
+                    "documents": batch_chunks,
+                    "metadatas": metadatas[i:i + ADD_BATCH_SIZE],
+                    "ids": ids[i:i + ADD_BATCH_SIZE]
+                }, future))
+                pending.append((i, len(batch_chunks), future))
+                logger.info(f"Queued batch {i//ADD_BATCH_SIZE + 1}: {len(batch_chunks)} chunks (embed {embed_time:.2f}s)")
+            except Exception as batch_error:
+                logger.error(f"Failed to embed batch {i//ADD_BATCH_SIZE + 1}: {str(batch_error)}")
+                continue
+        
+        # Report success only once the writer has actually stored each batch
+        for i, count, future in pending:
+            try:
+                add_time = future.result()
+                added[i:i + count] = [True] * count
+                logger.info(f"Added batch {i//ADD_BATCH_SIZE + 1}: {count} chunks (insert {add_time:.2f}s)")
+            except Exception as batch_error:
+                logger.error(f"Failed to add batch {i//ADD_BATCH_SIZE + 1}: {str(batch_error)}")
+        return added
 
     def add_document(self, text: str, metadata: dict, page_texts: Dict[int, str] = None) -> int:
         try:
-            if not text or len(text.strip()) < 20:
-                logger.warning(f"Text too short for document {metadata.get('document_id', 'unknown')}")
-                return 0
-            
-            cleaned_text = self._clean_and_validate_text(text)
-            if not cleaned_text:
-                logger.warning(f"No valid text after cleaning for {metadata.get('document_id')}")
-                return 0
-            
-            chunks = self.text_splitter.split_text(cleaned_text)
+            chunks, chunk_metadatas, chunk_ids = self._prepare_chunks(text, metadata)
             if not chunks:
-                logger.warning(f"No chunks created for document {metadata.get('document_id')}")
                 return 0
             
-            batch_size = 10
-            total_chunks_added = 0
-            
-            for i in range(0, len(chunks), batch_size):
-                batch_chunks = chunks[i:i + batch_size]
-                batch_ids = []
-                batch_metadatas = []
-                valid_batch_chunks = []
-                
-                for j, chunk in enumerate(batch_chunks):
-                    if len(chunk.strip()) < 20:
-                        continue
-                    
-                    chunk_id = f"{metadata['document_id']}_chunk_{i + j}"
-                    page_num = self._extract_page_from_chunk(chunk)
-                    
-                    chunk_metadata = {
-                        **metadata,
-                        "chunk_id": chunk_id,
-                        "page": page_num,
-                        "chunk_index": i + j,
-                        "text_length": len(chunk)
-                    }
-                    
-                    batch_ids.append(chunk_id)
-                    batch_metadatas.append(chunk_metadata)
-                    valid_batch_chunks.append(chunk)
-                
-                if valid_batch_chunks:
-                    try:
-                        start_time = time.time()
-                        self.collection.add(
-                            documents=valid_batch_chunks,
-                            metadatas=batch_metadatas,
-                            ids=batch_ids
-                        )
-                        add_time = time.time() - start_time
-                        total_chunks_added += len(valid_batch_chunks)
-                        logger.info(f"Added batch {i//batch_size + 1}: {len(valid_batch_chunks)} chunks in {add_time:.2f}s")
-                    except Exception as batch_error:
-                        logger.error(f"Failed to add batch {i//batch_size + 1}: {str(batch_error)}")
-                        continue
-            
+            total_chunks_added = sum(self._add_chunks(chunks, chunk_metadatas, chunk_ids))
             logger.info(f"Successfully added {total_chunks_added} chunks for document {metadata.get('document_id')}")
             return total_chunks_added
             
@@ -151,6 +386,33 @@ class VectorDB:
             logger.error(f"Failed to add document {metadata.get('document_id', 'unknown')}: {str(e)}", exc_info=True)
             raise
 
+    def add_documents(self, docs: List[Tuple[str, dict]]) -> List[int]:
+        """Ingest several documents through one bulk insert; returns chunks stored per document"""
+        try:
+            all_chunks = []
+            all_metadatas = []
+            all_ids = []
+            bounds = []
+            for text, metadata in docs:
+                chunks, chunk_metadatas, chunk_ids = self._prepare_chunks(text, metadata)
+                bounds.append((len(all_chunks), len(all_chunks) + len(chunks)))
+                all_chunks.extend(chunks)
+                all_metadatas.extend(chunk_metadatas)
+                all_ids.extend(chunk_ids)
+            
+            if not all_chunks:
+                logger.warning(f"No chunks created for {len(docs)} documents")
+                return [0] * len(docs)
+            
+            added = self._add_chunks(all_chunks, all_metadatas, all_ids)
+            chunk_counts = [sum(added[start:end]) for start, end in bounds]
+            logger.info(f"Added {sum(chunk_counts)} chunks from {len(docs)} documents")
+            return chunk_counts
+            
+        except Exception as e:
+            logger.error(f"Failed to add {len(docs)} documents: {str(e)}", exc_info=True)
+            raise
+
     def search(self, query: str, n_results: int = 3) -> dict:  # Changed to 3
         try:
             if not query.strip():
@@ -198,18 +460,21 @@ class VectorDB:
                 "pages": []
             }
             
-            for doc, meta, dist in zip(documents, metadatas, distances):
-                content_hash = hashlib.md5(doc.encode()).hexdigest()
+            # Apply the distance cutoff in one vectorised pass; only survivors reach the dedup loop
+            kept_idx = np.flatnonzero(np.asarray(distances) <= 0.8)
+            
+            for i in kept_idx:
+                doc, meta, dist = documents[i], metadatas[i], distances[i]
                 doc_id = meta.get("document_id", "unknown")
                 
-                if content_hash in seen_content:
+                # str hashes are computed once and cached by CPython; set membership still
+                # compares full text on a hash hit, so this is exact with no collisions
+                if doc in seen_content:
                     continue
                 if doc_id in seen_docs and seen_docs[doc_id] >= 2:
                     continue
-                if dist > 0.8:
-                    continue
                 
-                seen_content.add(content_hash)
+                seen_content.add(doc)
                 seen_docs[doc_id] = seen_docs.get(doc_id, 0) + 1
                 
                 unique_results["documents"].append(doc)
@@ -233,7 +498,7 @@ class VectorDB:
             return {
                 "total_documents": count,
                 "collection_name": self.collection.name,
-                "embedding_model": "sentence-transformers/all-MiniLM-L6-v2"
+                "embedding_model": EMBEDDING_MODEL_NAME
             }
         except Exception as e:
             logger.error(f"Failed to get collection stats: {str(e)}")
@@ -242,22 +507,43 @@ class VectorDB:
 class OptimizedEmbeddingFunction:
     def __init__(self):
         try:
-            model_name = 'sentence-transformers/all-MiniLM-L6-v2'
-            self.model = SentenceTransformer(model_name)
-            self.model.max_seq_length = 256
-            logger.info(f"Loaded optimized embedding model: {model_name}")
+            self.session, self.tokenizer = _get_model()
+            self._tokenizer_lock = threading.Lock()  # Queries and ingest threads encode concurrently
+            self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+            # Hidden size is static in the exported graph; only probe with a forward pass if it isn't
+            output_dim = self.session.get_outputs()[0].shape[-1]
+            self.dimension = output_dim if isinstance(output_dim, int) else len(self(["test"])[0])
         except Exception as e:
             logger.error(f"Failed to load embedding model: {str(e)}", exc_info=True)
             raise
     
-    @lru_cache(maxsize=1000)
-    def _cached_encode(self, text: str) -> tuple:
-        try:
-            embedding = self.model.encode([text], show_progress_bar=False, convert_to_tensor=False)[0]
-            return tuple(embedding.tolist())
-        except Exception as e:
-            logger.error(f"Encoding failed for text: {text[:50]}... Error: {str(e)}")
-            raise
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Mean-pooled, L2-normalized sentence embeddings (same as SentenceTransformer.encode)"""
+        # Smart batching: group texts of similar length so each batch pads only to its own max
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        
+        batches = []
+        for i in range(0, len(sorted_texts), EMBEDDING_BATCH_SIZE):
+            with self._tokenizer_lock:
+                encoded = self.tokenizer(
+                    sorted_texts[i:i + EMBEDDING_BATCH_SIZE],
+                    padding=True,
+                    truncation=True,
+                    max_length=MAX_SEQ_LENGTH,
+                    return_tensors="np"
+                )
+            feeds = {name: encoded[name].astype(np.int64) for name in self.input_names}
+            token_embeddings = self.session.run(None, feeds)[0].astype(np.float32)  # FP16 graph -> FP32 for Chroma
+            
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            batches.append(pooled)
+        
+        embeddings = np.empty((len(texts), batches[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(batches)  # Undo the length sort
+        return embeddings
     
     def __call__(self, input: List[str]) -> List[List[float]]:
         try:
@@ -265,15 +551,7 @@ class OptimizedEmbeddingFunction:
                 return []
             
             start_time = time.time()
-            if len(input) <= 5:
-                embeddings = [list(self._cached_encode(text)) for text in input]
-            else:
-                embeddings = self.model.encode(
-                    input, 
-                    show_progress_bar=False, 
-                    convert_to_tensor=False,
-                    batch_size=16
-                ).tolist()
+            embeddings = self._encode(input).tolist()
             
             encode_time = time.time() - start_time
             logger.info(f"Encoded {len(input)} texts in {encode_time:.2f}s")
@@ -281,4 +559,4 @@ class OptimizedEmbeddingFunction:
             
         except Exception as e:
             logger.error(f"Batch embedding failed: {str(e)}", exc_info=True)
-            raise
\ No newline at end of file
+            raise
@@ -1,9 +1,13 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from PIL import Image
 import io
+import time
 import logging
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Configure logging for frontend
 logging.basicConfig(level=logging.INFO)
@@ -12,12 +16,56 @@ logger = logging.getLogger(__name__)
 # --- Config ---
 st.set_page_config(page_title="DocuMind", page_icon="📚", layout="centered")
 BACKEND_URL = "http://localhost:8000"
+STATUS_POLL_INTERVAL = 1  # seconds
+STATUS_POLL_TIMEOUT = 300  # seconds
+
+@st.cache_resource
+def get_session():
+    """Pooled keep-alive HTTP session, kept across Streamlit reruns"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=8,
+        pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.1)
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=300, max_entries=256)
+def run_query(q):
+    """Repeat questions within 5 minutes are answered from cache instead of re-searching"""
+    response = get_session().get(f"{BACKEND_URL}/query", params={"q": q}, timeout=30)
+    response.raise_for_status()
+    return response.json()
+
+def wait_for_processing(session, document_id):
+    """Poll the backend until a queued upload has been processed"""
+    deadline = time.time() + STATUS_POLL_TIMEOUT
+    while time.time() < deadline:
+        response = session.get(f"{BACKEND_URL}/status/{document_id}", timeout=10)
+        response.raise_for_status()
+        job = response.json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(STATUS_POLL_INTERVAL)
+    return {"status": "failed", "detail": "Timed out waiting for processing"}
+
+# --- Static assets (read once, reused across reruns) ---
+@st.cache_data
+def _load_css(file_name):
+    with open(file_name) as f:
+        return f.read()
+
+@st.cache_data
+def _load_logo(file_name):
+    with open(file_name, "rb") as f:
+        return f.read()
 
 # --- Styles ---
 def local_css(file_name):
     try:
-        with open(file_name) as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        st.markdown(f"<style>{_load_css(file_name)}</style>", unsafe_allow_html=True)
     except FileNotFoundError:
         logger.warning(f"style.css not found, skipping CSS")
 
@@ -27,7 +75,7 @@ local_css("style.css")
 col1, col2 = st.columns([1, 4])
 with col1:
     try:
-        st.image("logo.png", width=80)
+        st.image(_load_logo("logo.png"), width=80)
     except FileNotFoundError:
         st.write("Logo not found")
 with col2:
@@ -54,41 +102,67 @@ with tab1:
     )
     
     if uploaded_files:
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        for i, file in enumerate(uploaded_files):
-            # Display file preview
+        # Display file previews before the network round-trip
+        for file in uploaded_files:
             if file.type.startswith('image/'):
                 img = Image.open(io.BytesIO(file.getvalue()))
                 st.image(img, caption=file.name, width=200)
+        
+        # Streamlit reruns this block on every interaction while files sit in the uploader;
+        # only send files this session hasn't ingested yet, or every question re-uploads them
+        ingested_ids = st.session_state.setdefault("ingested_file_ids", set())
+        new_files = [file for file in uploaded_files if file.file_id not in ingested_ids]
+        
+        if new_files:
+            progress_bar = st.progress(0)
+            status_text = st.empty()
             
-            # Upload to backend
+            # Upload all new files to the backend in one multipart request
             try:
-                response = requests.post(
-                    f"{BACKEND_URL}/upload",
-                    files={"file": (file.name, file.getvalue(), file.type)},
-                    timeout=30
+                response = get_session().post(
+                    f"{BACKEND_URL}/upload_batch",
+                    files=[("files", (file.name, file.getvalue(), file.type)) for file in new_files],
+                    timeout=60
                 )
                 
-                if response.status_code == 201:
-                    result = response.json()
-                    st.success(f"Uploaded {file.name}: {result['chunks_stored']} chunks stored")
-                    logger.info(f"Frontend: Successfully uploaded {file.name}")
+                if response.status_code == 202:
+                    documents = response.json()["documents"]
+                    # Wait on all documents concurrently so results show up in completion order
+                    with ThreadPoolExecutor(max_workers=8) as executor:
+                        futures = {
+                            executor.submit(wait_for_processing, get_session(), document["document_id"]): document["filename"]
+                            for document in documents
+                        }
+                        for i, future in enumerate(as_completed(futures)):
+                            filename = futures[future]
+                            try:
+                                job = future.result()
+                            except requests.exceptions.RequestException as e:
+                                job = {"status": "failed", "detail": f"Status check failed: {str(e)}"}
+                            
+                            if job["status"] == "completed":
+                                st.success(f"Uploaded {filename}: {job['chunks_stored']} chunks stored")
+                                logger.info(f"Frontend: Successfully uploaded {filename}")
+                            else:
+                                st.error(f"Failed to process {filename}: {job.get('detail', 'unknown error')}")
+                                logger.error(f"Frontend: Processing failed for {filename}: {job.get('detail')}")
+                            
+                            progress_bar.progress((i + 1) / len(documents))
+                            status_text.text(f"Processed {i+1}/{len(documents)}: {filename}")
                 else:
                     error_detail = response.json().get("detail", response.text)
-                    st.error(f"Failed to upload {file.name}: {response.status_code} - {error_detail}")
-                    logger.error(f"Frontend: Upload failed for {file.name}: {response.status_code} - {error_detail}")
-                
-                progress_bar.progress((i + 1) / len(uploaded_files))
-                status_text.text(f"Processed {i+1}/{len(uploaded_files)}: {file.name}")
+                    st.error(f"Failed to upload files: {response.status_code} - {error_detail}")
+                    logger.error(f"Frontend: Batch upload failed: {response.status_code} - {error_detail}")
             
             except requests.exceptions.RequestException as e:
-                st.error(f"Failed to upload {file.name}: {str(e)}")
-                logger.error(f"Frontend: Upload request failed for {file.name}: {str(e)}")
+                st.error(f"Failed to upload files: {str(e)}")
+                logger.error(f"Frontend: Batch upload request failed: {str(e)}")
+            
+            # Attempted files aren't resent on rerun; remove and re-add a file to retry it
+            ingested_ids.update(file.file_id for file in new_files)
+            run_query.clear()  # New documents can change answers to cached questions
         
-        if uploaded_files:
-            st.success(f"✅ Processed {len(uploaded_files)} documents")
+        st.success(f"✅ Processed {len(uploaded_files)} documents")
 
 with tab2:
     st.subheader("Ask Anything")
@@ -97,41 +171,34 @@ with tab2:
     if query:
         with st.spinner("Searching documents..."):
             try:
-                response = requests.get(
-                    f"{BACKEND_URL}/query",
-                    params={"q": query},
-                    timeout=30
-                )
+                data = run_query(query)
+                results = data.get("results", [])
                 
-                if response.status_code == 200:
-                    data = response.json()
-                    results = data.get("results", [])
+                if results:
+                    st.subheader("📌 Answers")
+                    # Prepare table data
+                    table_data = []
+                    for result in results:
+                        filename = result["metadata"]["filename"]
+                        answer = result["text"]
+                        pages = result["pages"]
+                        citation = ", ".join([f"page {p}" for p in pages])
+                        table_data.append({
+                            "Document": filename,  # Changed from "Doc Id" to "Document"
+                            "Extracted answer": answer,
+                            "Citation": citation
+                        })
                     
-                    if results:
-                        st.subheader("📌 Answers")
-                        # Prepare table data
-                        table_data = []
-                        for result in results:
-                            filename = result["metadata"]["filename"]
-                            answer = result["text"]
-                            pages = result["pages"]
-                            citation = ", ".join([f"page {p}" for p in pages])
-                            table_data.append({
-                                "Document": filename,  # Changed from "Doc Id" to "Document"
-                                "Extracted answer": answer,
-                                "Citation": citation
-                            })
-                        
-                        # Display as a table
-                        df = pd.DataFrame(table_data)
-                        st.table(df)
-                    else:
-                        st.warning("No relevant results found")
-                        logger.info(f"Frontend: No results for query: {query}")
+                    # Display as a table
+                    df = pd.DataFrame(table_data)
+                    st.table(df)
                 else:
-                    st.error(f"Failed to process query: {response.status_code} - {response.text}")
-                    logger.error(f"Frontend: Query failed: {response.status_code} - {response.text}")
+                    st.warning("No relevant results found")
+                    logger.info(f"Frontend: No results for query: {query}")
                     
+            except requests.exceptions.HTTPError as e:
+                st.error(f"Failed to process query: {e.response.status_code} - {e.response.text}")
+                logger.error(f"Frontend: Query failed: {e.response.status_code} - {e.response.text}")
             except requests.exceptions.RequestException as e:
                 st.error(f"Query request failed: {str(e)}")
                 logger.error(f"Frontend: Query request failed: {str(e)}")
\ No newline at end of file